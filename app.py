@@ -1,54 +1,65 @@
 import streamlit as st
-import tempfile
-import os
-import time
-from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import hashlib
 
 st.set_page_config(page_title="Tech Resume Analyzer", layout="centered")
 st.title("📄 Tech Resume Analyzer (Gemini + LangGraph + Google Sheets)")
 
 st.write("✅ UI loaded")
 
-# Import main app (LangGraph)
-from main import app as graph_app
-from pdf_utils import extract_text_from_pdf  # we will create this file below
+@st.cache_resource
+def _main():
+    # imported once per process on first Analyze, not on every rerun
+    import main
+    return main
+
+class AnalysisError(Exception):
+    """The agent returned a ❌ message instead of an analysis."""
+
+from pdf_utils import extract_text_from_pdf
 
 uploaded = st.file_uploader("Upload Resume PDF", type=["pdf"])
 job_desc = st.text_area("Optional: Paste Job Description (JD)", height=150)
 
-TIMEOUT_SECONDS = 60  # hard timeout so app can't freeze forever
+def stream_agent(resume_text: str, job_desc: str, result: dict):
+    # yields Gemini tokens as they arrive; the final graph state lands in `result`.
+    # No deadline here: stream_gemini bounds the model call by GEMINI_TIMEOUT and
+    # Sheets writes run on a background thread, so the graph can't hang the UI.
+    inputs = {"input": "", "resume_text": resume_text, "job_desc": job_desc, "output": ""}
+    for mode, chunk in _main().app.stream(inputs, stream_mode=["custom", "values"]):
+        if mode == "custom":
+            yield chunk
+        else:
+            result.update(chunk)
 
-def run_agent(user_input: str):
-    return graph_app.invoke({"input": user_input, "output": ""})
+@st.cache_data(ttl=3600, max_entries=128)
+def analyze_cached(key: str, _resume_text: str, _job_desc: str):
+    # keyed on resume+JD hashes only; hashing the full text again is wasted work
+    result = {}
+    st.write_stream(stream_agent(_resume_text, _job_desc, result))
+    output = result.get("output", "No output key found.")
+    if output.startswith("❌"):
+        raise AnalysisError(output)  # don't cache failures
+    return output  # Sheets status is transient, so it's read outside the cache
 
 if st.button("Analyze"):
     if not uploaded:
         st.error("Please upload a resume PDF.")
         st.stop()
 
-    st.info("Step 1/4: Saving PDF...")
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-        tmp.write(uploaded.read())
-        pdf_path = tmp.name
-    st.success(f"Saved PDF: {pdf_path}")
+    st.info("Step 1/4: Reading PDF...")
+    pdf_bytes = uploaded.getvalue()
+    cache_key = hashlib.sha256(pdf_bytes).hexdigest() + ":" + hashlib.sha256(job_desc.encode()).hexdigest()
+    st.success(f"Read PDF: {uploaded.name} ({len(pdf_bytes) // 1024} KB)")
 
     st.info("Step 2/4: Extracting text from PDF...")
     try:
-        resume_text = extract_text_from_pdf(pdf_path)
+        resume_text = extract_text_from_pdf(pdf_bytes)
     except Exception as e:
         st.error(f"PDF extraction failed: {e}")
-        try:
-            os.remove(pdf_path)
-        except:
-            pass
         st.stop()
 
     if not resume_text.strip():
         st.error("No readable text found in PDF (likely scanned image). Use a text-based PDF.")
-        try:
-            os.remove(pdf_path)
-        except:
-            pass
         st.stop()
 
     st.success("PDF text extracted ✅")
@@ -56,34 +67,20 @@ if st.button("Analyze"):
     st.code(resume_text[:300])
 
     st.info("Step 3/4: Calling Gemini + generating JSON (timeout enabled)...")
-    user_input = f"PDF_PATH={pdf_path} || JOB={job_desc}"
-
     with st.spinner("Analyzing..."):
-        with ThreadPoolExecutor(max_workers=1) as ex:
-            future = ex.submit(run_agent, user_input)
-            try:
-                result = future.result(timeout=TIMEOUT_SECONDS)
-            except TimeoutError:
-                st.error(f"❌ Timed out after {TIMEOUT_SECONDS}s. The model or Sheets call is hanging.")
-                st.info("Next: we will isolate whether Gemini or Google Sheets is causing the hang.")
-                try:
-                    os.remove(pdf_path)
-                except:
-                    pass
-                st.stop()
-            except Exception as e:
-                st.error(f"❌ Error while invoking agent: {e}")
-                try:
-                    os.remove(pdf_path)
-                except:
-                    pass
-                st.stop()
+        try:
+            output = analyze_cached(cache_key, resume_text, job_desc)
+        except AnalysisError as e:
+            st.error(str(e))
+            st.stop()
+        except Exception as e:
+            st.error(f"❌ Error while invoking agent: {e}")
+            st.stop()
 
     st.info("Step 4/4: Showing result...")
     st.subheader("✅ Output")
-    st.code(result.get("output", "No output key found."), language="json")
+    st.code(output, language="json")
 
-    try:
-        os.remove(pdf_path)
-    except:
-        pass
\ No newline at end of file
+    sheets_status = _main().sheets_status()
+    if sheets_status:
+        st.warning(sheets_status)
\ No newline at end of file
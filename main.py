@@ -2,24 +2,68 @@ from datetime import datetime
 from dotenv import load_dotenv
 from typing_extensions import TypedDict
 import os
-import json
+import re
+import atexit
+import logging
+import asyncio
 import time
-from concurrent.futures import ThreadPoolExecutor, TimeoutError
+import queue
+import threading
+from collections import deque
+from concurrent.futures import TimeoutError
 
-import gspread
-from google.oauth2.service_account import Credentials
-from pypdf import PdfReader
+import orjson
+import streamlit as st
+from pydantic import BaseModel, Field
+from tenacity import Retrying, retry_if_exception, stop_after_attempt, wait_random_exponential
 
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_google_genai.chat_models import ChatGoogleGenerativeAIError
+# gspread, google-auth, tiktoken and langchain_google_genai are imported on
+# first use; they dominate import time and the UI doesn't need them to render
+from langgraph.config import get_stream_writer
 from langgraph.graph import StateGraph, START, END
 
+from pdf_utils import extract_text_from_pdf, relevant_resume_text
+
 load_dotenv()
 
-llm = ChatGoogleGenerativeAI(
-    model="gemini-2.5-flash",
-    temperature=0.3
-)
+logger = logging.getLogger(__name__)
+
+class ResumeAnalysis(BaseModel):
+    """Response schema Gemini is constrained to; contact fields are parsed locally."""
+    resume_score: int = Field(description="Overall score from 0 to 100")
+    strengths: list[str]
+    gaps: list[str]
+    missing_keywords: list[str] = Field(description="ATS keywords from the JD missing in the resume")
+    improvements: list[str]
+    role_fit_summary: str
+
+GEMINI_TIMEOUT = 45  # wall-clock budget for the whole call, retries included
+GEMINI_THINKING_BUDGET = 1024  # flash thinks before its first chunk; cap it so that wait stays short
+# Per-attempt limit on the wait for the first chunk: a default until enough
+# timings are measured, then 2x the recent p90, clamped to [MIN, MAX]
+GEMINI_ATTEMPT_TIMEOUT = 20
+GEMINI_ATTEMPT_TIMEOUT_MIN = 10
+GEMINI_ATTEMPT_TIMEOUT_MAX = 30
+GEMINI_ATTEMPTS = 3
+RETRY_AFTER_MAX = 20
+
+@st.cache_resource
+def get_llm():
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    llm = ChatGoogleGenerativeAI(
+        model="gemini-2.5-flash",
+        temperature=0.3,
+        timeout=GEMINI_TIMEOUT,
+        thinking_budget=GEMINI_THINKING_BUDGET,
+        max_retries=0  # retries are handled by _start_stream
+    )
+    # native structured output: the reply is always JSON matching ResumeAnalysis,
+    # and it still streams token by token (with_structured_output would not)
+    return llm.bind(
+        response_mime_type="application/json",
+        response_schema=ResumeAnalysis.model_json_schema()
+    )
 
 SCOPES = [
     "https://www.googleapis.com/auth/spreadsheets",
@@ -28,127 +72,369 @@ SCOPES = [
 SERVICE_ACCOUNT_FILE = "service_account.json"
 SHEET_NAME = os.getenv("GSHEET_NAME", "Resume_Analyzer_Logs")
 
-GEMINI_TIMEOUT = 45
 SHEETS_TIMEOUT = 20
+SHEETS_BATCH_SIZE = 50
+SHEETS_FLUSH_DELAY = 0.5
+SHEETS_ATTEMPTS = 3
+SHEETS_QUEUE_MAX = 1000
+SHEETS_EXIT_TIMEOUT = 30
+
+def _build_sheets_session(creds):
+    from google.auth.transport.requests import AuthorizedSession
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
+
+    # pooled keep-alive connections so appends reuse TCP+TLS
+    session = AuthorizedSession(creds)
+    adapter = HTTPAdapter(
+        pool_connections=10,
+        pool_maxsize=50,
+        max_retries=Retry(total=2, backoff_factor=0.2)
+    )
+    session.mount("https://", adapter)
+    return session
+
+# Built once per process and reused; open() is a Drive round-trip
+@st.cache_resource
+def get_worksheet():
+    import gspread
+    from google.oauth2.service_account import Credentials
+
+    creds = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
+    gc = gspread.Client(auth=creds, session=_build_sheets_session(creds))
+    gc.set_timeout(SHEETS_TIMEOUT)  # gspread defaults to no timeout at all
+    return gc.open(SHEET_NAME).sheet1
+
+_INPUT_RE = re.compile(r"(?:^|\|\|)\s*(?:PDF_PATH=(?P<pdf>(?:(?!\|\|).)*)|JOB=(?P<job>(?:(?!\|\|).)*))", re.S)
+_EMAIL_RE = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+# 10+ digits (or a leading + / "(") on one line, not part of a longer digit run,
+# so date ranges like 2019-2021 don't pass for a phone number
+_PHONE_RE = re.compile(
+    r"(?<!\d)(?<!\d[ ().-])(?<!\d[ ().-]{2})"
+    r"(?:[+(]\d(?:[ ().-]{0,2}\d){6,14}|\d(?:[ ().-]{0,2}\d){9,14})"
+    r"(?![ ().-]{0,2}\d)"
+)
+_RETRY_DELAY_RE = re.compile(r"retry(?:_delay\s*\{\s*seconds:\s*|Delay\W+| in )(\d+(?:\.\d+)?)", re.I)
+_LIST_COLS = ("strengths", "gaps", "missing_keywords", "improvements")
+
+# Prompt budgets are in tokens; cl100k is close enough to Gemini's tokenizer for slicing
+RESUME_MAX_TOKENS = 5000
+JOB_MAX_TOKENS = 1500
+CHARS_PER_TOKEN = 4  # fallback when the tokenizer can't be loaded
+
+@st.cache_resource
+def _get_encoding():
+    # tiktoken downloads the BPE file on first use (see TIKTOKEN_CACHE_DIR in the README)
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.warning("tiktoken unavailable, limiting prompts by characters: %s", e)
+        return None
+
+def head_tokens(text: str, n: int) -> str:
+    enc = _get_encoding()
+    if enc is None:
+        return text[:n * CHARS_PER_TOKEN]
+    ids = enc.encode(text)
+    if len(ids) <= n:
+        return text
+    return enc.decode(ids[:n])
 
-def extract_text_from_pdf(pdf_path: str) -> str:
-    reader = PdfReader(pdf_path)
-    parts = []
-    for page in reader.pages:
-        parts.append(page.extract_text() or "")
-    return "\n".join(parts).strip()
+def extract_contacts(text: str) -> dict:
+    """Pull name/email/phone straight from the resume text (no LLM needed)."""
+    email = _EMAIL_RE.search(text)
+    phone = _PHONE_RE.search(text)
+    name = next((line.strip() for line in text.splitlines() if line.strip()), "")
+    return {
+        "name": name,
+        "email": email.group(0) if email else "",
+        "phone": phone.group(0).strip() if phone else ""
+    }
 
-def safe_json(text: str) -> dict:
+# One event loop multiplexes every in-flight Gemini stream, so a slow call
+# holds a coroutine rather than a pool worker and timeouts actually cancel it
+_LOOP = asyncio.new_event_loop()
+threading.Thread(target=_LOOP.run_forever, name="gemini-loop", daemon=True).start()
+
+def _run_async(coro, timeout: float):
     try:
-        return json.loads(text)
-    except Exception:
-        return {}
-
-def invoke_gemini_with_timeout(prompt: str) -> str:
-    def _call():
-        return llm.invoke(prompt).content.strip()
-
-    with ThreadPoolExecutor(max_workers=1) as ex:
-        fut = ex.submit(_call)
-        return fut.result(timeout=GEMINI_TIMEOUT)
-
-def append_to_sheet_with_timeout(row: list):
-    def _call():
-        creds = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-        gc = gspread.authorize(creds)
-        ws = gc.open(SHEET_NAME).sheet1
-        ws.append_row(row, value_input_option="USER_ENTERED")
+        return asyncio.run_coroutine_threadsafe(asyncio.wait_for(coro, timeout), _LOOP).result()
+    except asyncio.TimeoutError:
+        raise TimeoutError() from None
+
+def _close_async_stream(stream):
+    asyncio.run_coroutine_threadsafe(stream.aclose(), _LOOP)
+
+# Gemini errors differ across langchain-google-genai versions (ChatGoogleGenerativeAIError
+# in 2.x, GoogleAPIError wrapping google.genai errors in 4.x), so classify by HTTP
+# status and exception type name anywhere in the cause chain rather than by one class
+_RATE_LIMIT_CODES = (429,)
+_TRANSIENT_CODES = (429, 500, 502, 503, 504)
+_RATE_LIMIT_TYPES = {"ResourceExhausted", "TooManyRequests", "ModelRateLimitError", "RateLimitError"}
+_TRANSIENT_TYPES = _RATE_LIMIT_TYPES | {"ServiceUnavailable", "InternalServerError", "ServerError", "DeadlineExceeded"}
+
+def _error_chain(e: BaseException):
+    seen = set()
+    while e is not None and id(e) not in seen:
+        seen.add(id(e))
+        yield e
+        e = e.__cause__ or e.__context__
+
+def _status_code(e: BaseException):
+    for attr in ("code", "status_code"):
+        code = getattr(e, attr, None)
+        if isinstance(code, int):
+            return code
+    return None
+
+def _is_gemini_error(e: BaseException) -> bool:
+    return any(type(err).__module__.startswith(("langchain_google_genai", "google.")) for err in _error_chain(e))
+
+def _matches(e: BaseException, codes: tuple, types: set, markers: tuple) -> bool:
+    for err in _error_chain(e):
+        if _status_code(err) in codes or any(c.__name__ in types for c in type(err).__mro__):
+            return True
+    return _is_gemini_error(e) and any(k in str(e) for k in markers)
+
+def _is_rate_limited(e: BaseException) -> bool:
+    return _matches(e, _RATE_LIMIT_CODES, _RATE_LIMIT_TYPES, ("RESOURCE_EXHAUSTED", "429"))
+
+def _is_transient(e: BaseException) -> bool:
+    if isinstance(e, TimeoutError):
         return True
+    return _matches(e, _TRANSIENT_CODES, _TRANSIENT_TYPES, ("RESOURCE_EXHAUSTED", "429", "UNAVAILABLE", "503"))
+
+_backoff = wait_random_exponential(min=0.5, max=8)
+_ttfc_samples = deque(maxlen=20)  # recent time-to-first-chunk, seconds
 
-    with ThreadPoolExecutor(max_workers=1) as ex:
-        fut = ex.submit(_call)
-        return fut.result(timeout=SHEETS_TIMEOUT)
+def _attempt_timeout() -> float:
+    samples = sorted(_ttfc_samples)
+    if len(samples) < 5:
+        return GEMINI_ATTEMPT_TIMEOUT
+    p90 = samples[int(len(samples) * 0.9) - 1]
+    return min(max(2 * p90, GEMINI_ATTEMPT_TIMEOUT_MIN), GEMINI_ATTEMPT_TIMEOUT_MAX)
+
+def _retry_wait(retry_state) -> float:
+    # honour the server's suggested retry delay on 429s, else jittered backoff
+    m = _RETRY_DELAY_RE.search(str(retry_state.outcome.exception()))
+    if m:
+        return min(float(m.group(1)), RETRY_AFTER_MAX)
+    return _backoff(retry_state)
+
+def _first_chunk(prompt: str, stats: dict, deadline: float):
+    stats["attempts"] += 1
+    adaptive = _attempt_timeout()
+    timeout = min(adaptive, deadline - time.monotonic())
+    started = time.monotonic()
+    stream = get_llm().astream(prompt)
+    try:
+        first = _run_async(anext(stream, None), timeout)
+    except BaseException as e:
+        if isinstance(e, TimeoutError) and timeout >= adaptive:
+            _ttfc_samples.append(timeout)  # censored sample, so slow periods raise the limit
+        _close_async_stream(stream)
+        raise
+    _ttfc_samples.append(time.monotonic() - started)
+    return first, stream
+
+def _start_stream(prompt: str, stats: dict, deadline: float):
+    # only the wait for the first chunk is retried; nothing has been shown yet.
+    # Attempts and backoff sleeps are capped so the whole thing ends by `deadline`.
+    def _out_of_budget(retry_state) -> bool:
+        return deadline - time.monotonic() < GEMINI_ATTEMPT_TIMEOUT_MIN
+
+    def _wait(retry_state) -> float:
+        return max(0.0, min(_retry_wait(retry_state), deadline - time.monotonic() - GEMINI_ATTEMPT_TIMEOUT_MIN))
+
+    retrying = Retrying(
+        stop=stop_after_attempt(GEMINI_ATTEMPTS) | _out_of_budget,
+        wait=_wait,
+        retry=retry_if_exception(_is_transient),
+        reraise=True
+    )
+    for attempt in retrying:
+        with attempt:
+            return _first_chunk(prompt, stats, deadline)
+
+def stream_gemini(prompt: str, stats: dict | None = None):
+    # wall-clock bound over the whole stream, enforced per chunk;
+    # stats["attempts"] counts the attempts made to start it
+    stats = {"attempts": 0} if stats is None else stats
+    deadline = time.monotonic() + GEMINI_TIMEOUT
+    chunk, stream = _start_stream(prompt, stats, deadline)
+    try:
+        while chunk is not None:
+            yield chunk.content
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError()
+            chunk = _run_async(anext(stream, None), remaining)
+    finally:
+        _close_async_stream(stream)
+
+def append_rows_to_sheet(rows: list):
+    from gspread.exceptions import APIError
+
+    try:
+        get_worksheet().append_rows(rows, value_input_option="USER_ENTERED")
+    except APIError as e:
+        # expired/revoked auth: rebuild the client and retry once
+        if e.response.status_code not in (401, 403):
+            raise
+        get_worksheet.clear()
+        get_worksheet().append_rows(rows, value_input_option="USER_ENTERED")
+
+# Rows are queued by agent_node and written in batches off the request path
+_SHEETS_Q = queue.Queue(maxsize=SHEETS_QUEUE_MAX)
+_sheets_error = None  # last write failure, surfaced to users until a write succeeds
+
+def _sheets_writer():
+    global _sheets_error
+    # build the worksheet handle once, up front, so the first append doesn't pay for auth
+    try:
+        get_worksheet()
+    except Exception as e:
+        logger.warning("Sheets warm-up failed: %s", e)
+    while True:
+        batch = [_SHEETS_Q.get()]
+        time.sleep(SHEETS_FLUSH_DELAY)
+        while len(batch) < SHEETS_BATCH_SIZE:
+            try:
+                batch.append(_SHEETS_Q.get_nowait())
+            except queue.Empty:
+                break
+        for attempt in range(1, SHEETS_ATTEMPTS + 1):
+            try:
+                append_rows_to_sheet(batch)
+                _sheets_error = None
+                break
+            except Exception as e:
+                _sheets_error = e
+                logger.warning("Sheets append failed (attempt %d/%d, %d row(s)): %s", attempt, SHEETS_ATTEMPTS, len(batch), e)
+                if attempt < SHEETS_ATTEMPTS:
+                    time.sleep(2 ** attempt)
+        else:
+            logger.error("Dropping %d Sheets row(s) after %d attempts", len(batch), SHEETS_ATTEMPTS)
+        for _ in batch:
+            _SHEETS_Q.task_done()
+
+def sheets_status() -> str:
+    """Current Sheets logging problem as a ⚠️ message, or "" when logging is healthy."""
+    if _SHEETS_Q.full():
+        return "⚠️ Sheets logging backlog is full; new analyses are not being logged."
+    if _sheets_error is not None:
+        return f"⚠️ Sheets logging is failing (will retry): {_sheets_error}"
+    return ""
+
+def _drain_sheets_queue():
+    # the writer is a daemon thread; give queued rows a chance to land before exit
+    # (matters for one-shot callers like `python main.py`)
+    deadline = time.monotonic() + SHEETS_EXIT_TIMEOUT
+    while _SHEETS_Q.unfinished_tasks and time.monotonic() < deadline:
+        time.sleep(0.1)
+    if _SHEETS_Q.unfinished_tasks:
+        logger.error("Exiting with %d Sheets row(s) not written", _SHEETS_Q.unfinished_tasks)
+
+threading.Thread(target=_sheets_writer, name="sheets-writer", daemon=True).start()
+atexit.register(_drain_sheets_queue)
 
 class AgentState(TypedDict):
     input: str
+    resume_text: str
+    job_desc: str
     output: str
+    sheets_status: str
 
 def agent_node(state: AgentState) -> AgentState:
     user_input = (state.get("input") or "").strip()
-    if not user_input:
+    resume_text = (state.get("resume_text") or "").strip()
+    if not user_input and not resume_text:
         return {"input": "", "output": "Empty input. Use: PDF_PATH=resume.pdf || JOB=... (optional)"}
 
+    # PDF_PATH=... || JOB=... is the CLI protocol; the UI passes the JD through state
+    # because a pasted JD may itself contain "||"
     pdf_path = ""
-    job_desc = ""
-    parts = [p.strip() for p in user_input.split("||")]
-    for p in parts:
-        if p.startswith("PDF_PATH="):
-            pdf_path = p.replace("PDF_PATH=", "").strip().strip("'").strip('"')
-        elif p.startswith("JOB="):
-            job_desc = p.replace("JOB=", "").strip()
+    job_desc = (state.get("job_desc") or "").strip()
+    for m in _INPUT_RE.finditer(user_input):
+        if m.group("pdf") is not None:
+            pdf_path = m.group("pdf").strip().strip("'").strip('"')
+        elif not job_desc:
+            job_desc = m.group("job").strip()
 
-    if not pdf_path:
-        return {"input": user_input, "output": "Missing PDF_PATH. Example: PDF_PATH=resume.pdf || JOB=Data Engineer"}
+    # Callers that already extracted the text (the Streamlit UI) skip the PDF parse
+    if not resume_text:
+        if not pdf_path:
+            return {"input": user_input, "output": "Missing PDF_PATH. Example: PDF_PATH=resume.pdf || JOB=Data Engineer"}
 
-    try:
-        resume_text = extract_text_from_pdf(pdf_path)
-    except Exception as e:
-        return {"input": user_input, "output": f"Could not read PDF: {e}"}
+        try:
+            resume_text = extract_text_from_pdf(pdf_path)
+        except Exception as e:
+            return {"input": user_input, "output": f"Could not read PDF: {e}"}
 
-    if not resume_text:
-        return {"input": user_input, "output": "PDF has no readable text (maybe scanned). Use a text-based PDF."}
+        if not resume_text:
+            return {"input": user_input, "output": "PDF has no readable text (maybe scanned). Use a text-based PDF."}
+
+    # Only send each prompt the part of the resume it needs
+    relevant_text = relevant_resume_text(resume_text)
 
     analysis_prompt = f"""
 You are a technical resume analyzer for software/data roles.
 Be direct, ATS-aware, and practical. No fluff.
 
-RESUME TEXT:
-{resume_text[:18000]}
+RESUME (summary and education omitted):
+{head_tokens(relevant_text, RESUME_MAX_TOKENS)}
 
 JOB DESCRIPTION (optional):
-{(job_desc or '')[:8000]}
+{head_tokens(job_desc or '', JOB_MAX_TOKENS)}
 
-Return ONLY valid JSON (no markdown, no extra text) with exactly these keys:
-name, email, phone, resume_score, strengths, gaps, missing_keywords, improvements, role_fit_summary
+Fill in every field of the response schema.
 """
 
-    # 1) Gemini call with hard timeout
+    # 1) Gemini call (streamed to graph.stream(stream_mode="custom") callers) with hard timeout
+    stats = {"attempts": 0}
+    started = time.monotonic()
     try:
-        raw = invoke_gemini_with_timeout(analysis_prompt)
+        writer = get_stream_writer()
+        chunks = []
+        for chunk in stream_gemini(analysis_prompt, stats):
+            writer(chunk)
+            chunks.append(chunk)
+        analysis = ResumeAnalysis.model_validate_json("".join(chunks))
     except TimeoutError:
-        return {"input": user_input, "output": f"❌ Gemini call timed out after {GEMINI_TIMEOUT}s."}
-    except ChatGoogleGenerativeAIError as e:
-        msg = str(e)
-        if "RESOURCE_EXHAUSTED" in msg or "429" in msg:
-            return {"input": user_input, "output": "❌ Gemini quota/rate limit exceeded (429 RESOURCE_EXHAUSTED). Enable billing / wait / new key."}
-        return {"input": user_input, "output": f"❌ Gemini error: {e}"}
+        elapsed = time.monotonic() - started
+        return {"input": user_input, "output": f"❌ Gemini call timed out after {elapsed:.1f}s ({stats['attempts']} attempt(s))."}
     except Exception as e:
+        if _is_rate_limited(e):
+            return {"input": user_input, "output": "❌ Gemini quota/rate limit exceeded (429 RESOURCE_EXHAUSTED). Enable billing / wait / new key."}
+        if _is_gemini_error(e):
+            return {"input": user_input, "output": f"❌ Gemini error: {e}"}
         return {"input": user_input, "output": f"❌ Unexpected Gemini error: {e}"}
 
-    data = safe_json(raw)
-    if not data:
-        return {"input": user_input, "output": "❌ Model returned invalid JSON. Try again with a cleaner resume PDF."}
+    data = {**extract_contacts(resume_text), **analysis.model_dump()}
 
-    # 2) Sheets logging with hard timeout
+    # 2) Sheets logging (queued, written in the background)
     ts = datetime.utcnow().isoformat()
     row = [
         ts,
         data.get("name", ""),
         data.get("email", ""),
         data.get("phone", ""),
-        int(data.get("resume_score", 0) or 0),
-        json.dumps(data.get("strengths", []), ensure_ascii=False),
-        json.dumps(data.get("gaps", []), ensure_ascii=False),
-        json.dumps(data.get("missing_keywords", []), ensure_ascii=False),
-        json.dumps(data.get("improvements", []), ensure_ascii=False),
+        int(data.get("resume_score") or 0),
+        *[orjson.dumps(data.get(k, [])).decode() for k in _LIST_COLS],
         data.get("role_fit_summary", ""),
         (resume_text[:300] + "...") if len(resume_text) > 300 else resume_text
     ]
 
+    output = orjson.dumps(data, option=orjson.OPT_INDENT_2).decode()
     try:
-        append_to_sheet_with_timeout(row)
-    except TimeoutError:
-        # return analysis anyway
-        return {"input": user_input, "output": json.dumps(data, indent=2, ensure_ascii=False) + f"\n\n⚠️ Sheets logging timed out after {SHEETS_TIMEOUT}s."}
-    except Exception as e:
-        return {"input": user_input, "output": json.dumps(data, indent=2, ensure_ascii=False) + f"\n\n⚠️ Sheets logging failed: {e}"}
+        _SHEETS_Q.put_nowait(row)
+    except queue.Full:
+        logger.error("Sheets queue full; dropping row for %s", data.get("email") or "unknown")
 
-    return {"input": user_input, "output": json.dumps(data, indent=2, ensure_ascii=False)}
+    # Sheets problems are reported separately so the analysis itself stays cacheable
+    return {"input": user_input, "output": output, "sheets_status": sheets_status()}
 
 graph = StateGraph(AgentState)
 graph.add_node("agent", agent_node)
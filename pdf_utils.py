@@ -1,8 +1,80 @@
-from pypdf import PdfReader
-
-def extract_text_from_pdf(pdf_path: str) -> str:
-    reader = PdfReader(pdf_path)
-    parts = []
-    for page in reader.pages:
-        parts.append(page.extract_text() or "")
-    return "\n".join(parts).strip()
\ No newline at end of file
+import io
+import re
+
+_SPACES_RE = re.compile(r"[ \t]+")
+_BLANK_LINES_RE = re.compile(r"\n{3,}")
+_NOISE_ITEMS = {"•", "-"}
+
+# A header is a short line holding only the section keyword, optionally with a
+# qualifier ("TECHNICAL SKILLS") and a trailing colon. Bullets like
+# "Experience building ETL pipelines" don't match, so they don't start a section.
+_SECTION_RE = re.compile(
+    r"(?im)^[ \t]*(?:(?:technical|professional|relevant|academic|key|core|personal|other)[ \t]+)?"
+    r"(summary|profile|objective|education|skills|experience"
+    r"|work[ \t]+(?:experience|history)|employment(?:[ \t]+history)?|projects"
+    r"|certifications|achievements|awards|publications|languages|interests|activities|leadership|volunteering)"
+    r"[ \t]*:?[ \t]*$"
+)
+_SECTION_ALIASES = {"profile": "summary", "objective": "summary"}
+_KNOWN_SECTIONS = {"summary", "education", "skills", "experience", "projects"}
+SKIPPED_SECTIONS = ("summary", "education")
+
+def _clean_page(text: str) -> str:
+    # drop empty/bullet-only lines and squeeze runs of spaces; they only cost tokens
+    lines = []
+    for line in text.splitlines():
+        line = _SPACES_RE.sub(" ", line).strip()
+        if line and line not in _NOISE_ITEMS:
+            lines.append(line)
+    return "\n".join(lines)
+
+def _join_pages(pages) -> str:
+    out = "\n\n".join(_clean_page(p) for p in pages)
+    return _BLANK_LINES_RE.sub("\n\n", out).strip()
+
+def _extract_with_pypdf(pdf) -> str:
+    from pypdf import PdfReader
+
+    reader = PdfReader(io.BytesIO(pdf) if isinstance(pdf, bytes) else pdf)
+    return _join_pages(page.extract_text() or "" for page in reader.pages)
+
+def extract_text_from_pdf(pdf) -> str:
+    """Extract text from a PDF given as a file path or raw bytes."""
+    # PyMuPDF is a C extension and much faster; pypdf stays as a fallback
+    # (also when PyMuPDF itself is missing or fails to import)
+    try:
+        import pymupdf
+
+        if isinstance(pdf, bytes):
+            doc = pymupdf.open(stream=pdf, filetype="pdf")
+        else:
+            doc = pymupdf.open(pdf)
+        with doc:
+            return _join_pages(page.get_text("text") for page in doc)
+    except Exception:
+        return _extract_with_pypdf(pdf)
+
+def _section_name(keyword: str) -> str:
+    key = " ".join(keyword.lower().split())
+    if key.startswith(("work", "employment")):
+        return "experience"
+    key = _SECTION_ALIASES.get(key, key)
+    return key if key in _KNOWN_SECTIONS else "other"
+
+def split_text_into_sections(text: str) -> dict:
+    """Cut resume text on section headers. Text before the first header is "header";
+    secondary sections (certifications, awards, ...) are collected under "other"."""
+    sections = {}
+    name, start = "header", 0
+    for m in _SECTION_RE.finditer(text):
+        sections[name] = (sections.get(name, "") + "\n" + text[start:m.start()]).strip()
+        name = _section_name(m.group(1))
+        start = m.start()
+    sections[name] = (sections.get(name, "") + "\n" + text[start:]).strip()
+    return sections
+
+def relevant_resume_text(text: str) -> str:
+    """Resume text for the analysis prompt: everything except summary/education."""
+    sections = split_text_into_sections(text)
+    parts = [body for name, body in sections.items() if body and name not in SKIPPED_SECTIONS]
+    return "\n\n".join(parts) or text
\ No newline at end of file
@@ -0,0 +1,56 @@
+from pdf_utils import relevant_resume_text, split_text_into_sections
+
+RESUME = """Jane Roe
+jane@example.com | +1 (555) 123-4567
+SUMMARY
+Data engineer with 5 years of experience.
+TECHNICAL SKILLS
+Python, SQL, Airflow
+PROFESSIONAL EXPERIENCE
+Acme Corp - Data Engineer
+Experience building ETL pipelines in Airflow
+EDUCATION
+B.Tech, Computer Science
+PROJECTS
+Streaming dashboard on Kafka
+"""
+
+
+def test_qualified_headers_start_sections():
+    sections = split_text_into_sections(RESUME)
+    assert list(sections) == ["header", "summary", "skills", "experience", "education", "projects"]
+    assert "Airflow" in sections["skills"]
+    assert "Acme Corp" in sections["experience"]
+
+
+def test_bullet_starting_with_keyword_is_not_a_header():
+    sections = split_text_into_sections(RESUME)
+    assert "Experience building ETL pipelines" in sections["experience"]
+    assert "Acme Corp" in sections["experience"]
+
+
+def test_header_variants():
+    text = "Work History:\nAcme\nAcademic Projects\nCompiler\nKey Skills\nGo\nEmployment History\nInitech"
+    sections = split_text_into_sections(text)
+    assert sections["experience"] == "Work History:\nAcme\nEmployment History\nInitech"
+    assert sections["projects"] == "Academic Projects\nCompiler"
+    assert sections["skills"] == "Key Skills\nGo"
+
+
+def test_relevant_text_keeps_skills_experience_projects_and_header():
+    text = relevant_resume_text(RESUME)
+    for kept in ("Jane Roe", "Python, SQL", "Acme Corp", "Kafka"):
+        assert kept in text
+    assert "B.Tech" not in text
+    assert "5 years" not in text
+
+
+def test_relevant_text_keeps_secondary_sections():
+    text = relevant_resume_text("EDUCATION\nB.Sc\nCertifications\nAWS SA")
+    assert "AWS SA" in text
+    assert "B.Sc" not in text
+
+
+def test_relevant_text_falls_back_to_full_text():
+    text = "SUMMARY\nOnly a summary here"
+    assert relevant_resume_text(text) == text